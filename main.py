@@ -17,7 +17,7 @@ import streamlit as st
 
 # DEFAULT_API_KEY = os.environ.get("TOGETHER_API_KEY")
 DEFAULT_API_KEY = "ca54c7724f542684e021cba3184731de4cf291dd213a8e3b4ead7bb7a48e5bc8"
-DEFAULT_BASE_URL = "https://api.together.xyz/v1"
+DEFAULT_BASE_URL = os.environ.get("TOGETHER_BASE_URL", "https://api.together.xyz/v1")
 DEFAULT_MODEL = "meta-llama/Llama-Vision-Free"
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_MAX_TOKENS = 512
@@ -272,6 +272,10 @@ class CSVExporter(ConversationExporter):
     
 def get_instance_id():
     """Retrieve the EC2 instance ID from AWS metadata using IMDSv2."""
+    # Skip the metadata lookup when disabled (e.g. during replay benchmarks)
+    if os.environ.get("AWS_EC2_METADATA_DISABLED", "").lower() == "true":
+        return "Instance ID not available (metadata lookup disabled)"
+
     try:
         # Step 1: Get the token
         token = requests.put(
@@ -0,0 +1,475 @@
+"""Record/replay harness for deterministic performance regression testing.
+
+Record mode runs a proxy in front of the Together API and captures every
+request/response with its timing (API key scrubbed). Replay mode serves the
+recorded traffic from a local fake server with the same latencies and chunk
+timing, drives the prompts through main.py with Streamlit's AppTest, and
+compares the results against a stored baseline.
+
+    python perf_harness.py record                # then: TOGETHER_BASE_URL=http://127.0.0.1:8765/v1 streamlit run main.py
+    python perf_harness.py replay --update-baseline
+    python perf_harness.py replay --threshold 0.15
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+import timeit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+import tiktoken
+
+DEFAULT_UPSTREAM_URL = "https://api.together.xyz/v1"
+DEFAULT_TRACE_PATH = "perf/trace.jsonl"
+DEFAULT_BASELINE_PATH = "perf/baseline.json"
+DEFAULT_PORT = 8765
+DEFAULT_THRESHOLD = 0.20
+MIN_TAIL_SAMPLES = 10  # Turns needed before p90 is stable enough to compare
+EXPORT_FORMATS = ["pdf", "txt", "json", "csv"]
+EXPORT_SAMPLES = 7  # timeit repeats per export format, each one auto-ranged to at least 0.2 s
+SCRUBBED = "***"
+CHECKED_REQUEST_PARAMS = ["model", "temperature", "max_tokens"]
+
+# Metrics compared against the baseline (higher is worse for all of them)
+COMPARED_METRICS = [
+    "latency_ms.p50", "latency_ms.p90",
+    "overhead_ms.mean", "overhead_ms.p50", "overhead_ms.p90",
+    "tokens_sent", "cpu_time_s",
+] + [f"export_ms.{fmt}" for fmt in EXPORT_FORMATS]
+
+
+# Function to count the prompt tokens of a chat completion request body
+def count_request_tokens(body):
+    try:
+        encoding = tiktoken.encoding_for_model(body.get("model", ""))
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return sum(len(encoding.encode(msg.get("content") or "")) for msg in body.get("messages", []))
+
+
+# Function to remove the API key from recorded text
+def scrub(text, api_key):
+    return text.replace(api_key, SCRUBBED) if api_key else text
+
+
+# Chunk payloads are stored as text; surrogateescape keeps split UTF-8 bytes intact
+def encode_chunk(data):
+    return data.decode("utf-8", errors="surrogateescape")
+
+
+def decode_chunk(text):
+    return text.encode("utf-8", errors="surrogateescape")
+
+
+### Record mode ###
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.forward(None)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.forward(self.rfile.read(length))
+
+    def forward(self, body):
+        server = self.server
+        auth = self.headers.get("Authorization", "")
+        api_key = auth.split(" ", 1)[1] if " " in auth else auth
+        headers = {key: value for key, value in self.headers.items() if key.lower() in ("authorization", "content-type", "accept")}
+
+        path = self.path[len("/v1"):] if self.path.startswith("/v1") else self.path
+
+        # Parse the request up front so a failure here can never cost us the trace entry
+        request_body, tokens_sent = None, 0
+        if body:
+            try:
+                request_body = json.loads(scrub(body.decode("utf-8"), api_key))
+                tokens_sent = count_request_tokens(request_body)
+            except Exception as e:
+                tokens_sent = None
+                print(f"Error reading request {self.command} {self.path}, recording it without full request details: {e}")
+
+        # Forward to the real API and time the headers and every body chunk
+        started = time.perf_counter()
+        try:
+            upstream = requests.request(
+                self.command,
+                server.upstream_url + path,
+                headers=headers,
+                data=body,
+                stream=True,
+                timeout=300,
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"Error forwarding {self.command} {self.path} (not recorded): {e}")
+            self.send_error(502, "Upstream request failed")
+            return
+        headers_s = time.perf_counter() - started
+
+        self.send_response(upstream.status_code)
+        self.send_header("Content-Type", upstream.headers.get("Content-Type", "application/json"))
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        chunks = []
+        for data in upstream.raw.stream(8192, decode_content=True):
+            if not data:
+                continue
+            chunks.append({"t": time.perf_counter() - started, "data": scrub(encode_chunk(data), api_key)})
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+        entry = {
+            "method": self.command,
+            "path": self.path,
+            "request": request_body,
+            "tokens_sent": tokens_sent,
+            "status": upstream.status_code,
+            "content_type": upstream.headers.get("Content-Type", "application/json"),
+            "headers_s": headers_s,
+            "total_s": time.perf_counter() - started,
+            "chunks": chunks,
+        }
+        with server.lock:
+            with open(server.trace_path, "a", encoding="utf-8") as trace_file:
+                trace_file.write(json.dumps(entry) + "\n")
+        print(f"Recorded {self.command} {self.path} ({entry['total_s'] * 1000:.0f} ms, {len(chunks)} chunks)")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def record(args):
+    Path(args.trace).parent.mkdir(parents=True, exist_ok=True)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), RecordingHandler)
+    server.upstream_url = args.upstream.rstrip("/")
+    server.trace_path = args.trace
+    server.lock = threading.Lock()
+    print(f"Recording to {args.trace}. Start the app with:")
+    print(f"  TOGETHER_BASE_URL=http://127.0.0.1:{args.port}/v1 streamlit run main.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+### Replay mode ###
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.replay(None)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.replay(json.loads(self.rfile.read(length) or b"null"))
+
+    def replay(self, body):
+        server = self.server
+        with server.lock:
+            if server.cursor >= len(server.entries):
+                self.send_error(400, "Replay trace exhausted")  # 4xx so the client fails fast instead of retrying
+                return
+            entry = server.entries[server.cursor]
+            server.cursor += 1
+            server.upstream_s += entry["total_s"]
+            server.received.append((entry, body))
+
+        if entry["path"] != self.path:
+            print(f"Warning: expected {entry['method']} {entry['path']}, got {self.command} {self.path}")
+
+        # Reproduce the recorded time to headers and the gaps between body chunks
+        started = time.perf_counter()
+        time.sleep(entry["headers_s"])
+        self.send_response(entry["status"])
+        self.send_header("Content-Type", entry["content_type"])
+        self.send_header("Transfer-Encoding", "chunked")
+        if entry["status"] >= 400:
+            # A fixed retry hint replaces the client's randomised backoff, which would otherwise count as app overhead
+            self.send_header("retry-after-ms", "1")
+        self.end_headers()
+        for chunk in entry["chunks"]:
+            time.sleep(max(0.0, chunk["t"] - (time.perf_counter() - started)))
+            data = decode_chunk(chunk["data"])
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def load_trace(trace_path):
+    with open(trace_path, encoding="utf-8") as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+
+def trace_sha256(trace_path):
+    return hashlib.sha256(Path(trace_path).read_bytes()).hexdigest()
+
+
+# Function to get the user prompt of each recorded chat turn
+def recorded_prompts(entries):
+    prompts = []
+    previous_request = None
+    for entry in entries:
+        if not (entry["path"].endswith("/chat/completions") and entry["request"]):
+            continue
+        # Client retries (e.g. after a 429) resend the same body and belong to the same turn
+        if entry["request"] != previous_request:
+            prompts.append(entry["request"]["messages"][-1]["content"])
+        previous_request = entry["request"]
+    return prompts
+
+
+# Function to describe how a replayed request differs from the recorded one
+def request_divergence(recorded, received):
+    if not recorded or not received:
+        return []
+    differences = [
+        f"{param} {recorded.get(param)!r} -> {received.get(param)!r}"
+        for param in CHECKED_REQUEST_PARAMS
+        if recorded.get(param) != received.get(param)
+    ]
+    recorded_roles = [msg["role"] for msg in recorded.get("messages", [])]
+    received_roles = [msg["role"] for msg in received.get("messages", [])]
+    if recorded_roles != received_roles:
+        differences.append(f"message roles {recorded_roles} -> {received_roles}")
+    elif recorded_roles and recorded_roles[0] == "system" and recorded["messages"][0]["content"] != received["messages"][0]["content"]:
+        differences.append("system message (personality) changed")
+    return differences
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def distribution(values):
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def run_replay(entries, port, timeout, check_requests=False):
+    from streamlit.testing.v1 import AppTest
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), ReplayHandler)
+    server.entries = entries
+    server.cursor = 0
+    server.upstream_s = 0.0
+    server.received = []
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ["TOGETHER_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["AWS_EC2_METADATA_DISABLED"] = "true"
+
+    try:
+        app = AppTest.from_file("main.py", default_timeout=timeout)
+        app.run()
+
+        # Drive every recorded prompt through the chat input, one script run per turn
+        latencies, overheads = [], []
+        cpu_started = time.process_time()
+        for prompt in recorded_prompts(entries):
+            upstream_before = server.upstream_s
+            started = time.perf_counter()
+            app.chat_input[0].set_value(prompt).run()
+            elapsed = time.perf_counter() - started
+            if app.exception:
+                raise RuntimeError(f"App raised during replay: {app.exception[0].message}")
+            latencies.append(elapsed * 1000)
+            overheads.append(max(0.0, elapsed - (server.upstream_s - upstream_before)) * 1000)
+        cpu_time = time.process_time() - cpu_started
+
+        # Counted after the measured window so the harness's own tokenizing is not charged to the app
+        tokens_sent = sum(count_request_tokens(body) for _, body in server.received if body)
+
+        # Only prompts are replayed, so sidebar changes made while recording show up as diverging requests
+        if check_requests:
+            for turn, (entry, body) in enumerate(server.received, start=1):
+                differences = request_divergence(entry["request"], body)
+                if differences:
+                    print(f"Warning: request {turn} differs from the trace: {'; '.join(differences)}")
+
+        active_chat_room = app.session_state["active_chat_room"]
+        conversation = list(app.session_state["chat_rooms"][active_chat_room])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return latencies, overheads, tokens_sent, cpu_time, (conversation, active_chat_room)
+
+
+# Function to time each exporter directly on the replayed conversation
+def time_exporters(conversation, chat_room_name):
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")  # Importing main.py outside `streamlit run` warns on every st call
+    import main
+
+    exporter_classes = {"pdf": main.PDFExporter, "txt": main.TXTExporter, "json": main.JSONExporter, "csv": main.CSVExporter}
+    export_ms = {}
+    for fmt in EXPORT_FORMATS:
+        timer = timeit.Timer(lambda: exporter_classes[fmt](conversation, chat_room_name).generate_file())
+        number, _ = timer.autorange()
+        export_ms[fmt] = min(timer.repeat(EXPORT_SAMPLES, number)) / number * 1000
+    return export_ms
+
+
+# Function to replay the trace several times and summarise the fastest sample of each timing
+def measure(entries, port, timeout, repeat):
+    # The first replay pays the Streamlit/AppTest cold start, so it is only a warm-up
+    run_replay(entries, port, timeout, check_requests=True)
+
+    runs = [run_replay(entries, port, timeout) for _ in range(repeat)]
+    latency_runs, overhead_runs, _, cpu_times, _ = zip(*runs)
+    tokens_sent, replayed_conversation = runs[-1][2], runs[-1][4]
+
+    # Keeping the fastest run per turn filters out scheduler noise before building the distribution
+    latencies = [min(samples) for samples in zip(*latency_runs)]
+    overheads = [min(samples) for samples in zip(*overhead_runs)]
+    return {
+        "turns": len(latencies),
+        "repeat": repeat,
+        "latency_ms": distribution(latencies),
+        "overhead_ms": distribution(overheads),
+        "tokens_sent": tokens_sent,
+        "cpu_time_s": min(cpu_times),
+        "export_ms": time_exporters(*replayed_conversation),
+    }
+
+
+def metric_value(results, name):
+    value = results
+    for key in name.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+# Function to explain why a baseline cannot be compared with the current results
+def baseline_mismatch(results, baseline):
+    if baseline.get("trace_sha256") != results["trace_sha256"]:
+        return f"baseline was recorded from a different trace ({baseline.get('trace', 'unknown')})"
+    if baseline.get("turns") != results["turns"]:
+        return f"baseline has {baseline.get('turns')} turns, the current replay has {results['turns']}"
+    return None
+
+
+# Function to list every metric that regressed past the threshold
+def compare(results, baseline, threshold):
+    regressions = []
+    for name in COMPARED_METRICS:
+        current, previous = metric_value(results, name), metric_value(baseline, name)
+        if current is None or previous is None:
+            continue
+        if name.endswith(".p90") and metric_value(results, "turns") < MIN_TAIL_SAMPLES:
+            print(f"  {name:<20} skipped (fewer than {MIN_TAIL_SAMPLES} turns)")
+            continue
+        if previous == 0:
+            print(f"  {name:<20} skipped (zero baseline, no relative limit)")
+            continue
+        limit = previous * (1 + threshold)
+        status = "REGRESSION" if current > limit else "ok"
+        print(f"  {name:<20} baseline {previous:>10.2f}  current {current:>10.2f}  limit {limit:>10.2f}  {status}")
+        if current > limit:
+            regressions.append(name)
+    return regressions
+
+
+def replay(args):
+    # The app and the token count both need tiktoken's cl100k_base, which is downloaded on first use
+    try:
+        tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"Error: tiktoken could not load cl100k_base ({e}). Run once with network access to cache it.")
+        return 1
+
+    if not Path(args.trace).exists():
+        print(f"Error: trace {args.trace} not found. Record one first with `python perf_harness.py record`.")
+        return 1
+    entries = load_trace(args.trace)
+    results = {"trace": args.trace, "trace_sha256": trace_sha256(args.trace)}
+    results.update(measure(entries, args.port, args.timeout, args.repeat))
+    print(json.dumps(results, indent=4))
+
+    if args.update_baseline or not Path(args.baseline).exists():
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(results, baseline_file, indent=4)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    mismatch = baseline_mismatch(results, baseline)
+    if mismatch:
+        print(f"Error: cannot compare against {args.baseline}: {mismatch}. Rerun with --update-baseline to replace it.")
+        return 1
+    if baseline.get("repeat") != results["repeat"]:
+        print(f"Warning: baseline used --repeat {baseline.get('repeat')}, this replay used --repeat {results['repeat']}")
+    print(f"Comparing against {args.baseline} (threshold {args.threshold:.0%}):")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Performance regression in: {', '.join(regressions)}")
+        return 1
+    print("No performance regressions.")
+    return 0
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record/replay performance harness for Scientia.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Proxy the Together API and record traffic to a trace")
+    record_parser.add_argument("--trace", default=DEFAULT_TRACE_PATH)
+    record_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    record_parser.add_argument("--upstream", default=DEFAULT_UPSTREAM_URL)
+    record_parser.set_defaults(func=record)
+
+    replay_parser = subparsers.add_parser("replay", help="Replay a trace through the app and compare with the baseline")
+    replay_parser.add_argument("--trace", default=DEFAULT_TRACE_PATH)
+    replay_parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    replay_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    replay_parser.add_argument("--port", type=int, default=0, help="Fake server port (0 picks a free port)")
+    replay_parser.add_argument("--timeout", type=float, default=120, help="Timeout per app run in seconds")
+    replay_parser.add_argument("--repeat", type=positive_int, default=5, help="Number of measured replays (after one warm-up replay)")
+    replay_parser.add_argument("--update-baseline", action="store_true")
+    replay_parser.set_defaults(func=replay)
+
+    args = parser.parse_args(argv)
+    args.trace = os.path.abspath(args.trace)
+    if args.mode == "replay":
+        args.baseline = os.path.abspath(args.baseline)
+    os.chdir(Path(__file__).resolve().parent)  # main.py loads fonts/ and media/ relative to the repo root
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
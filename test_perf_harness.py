@@ -0,0 +1,122 @@
+import argparse
+import json
+
+import pytest
+
+import perf_harness
+
+
+def chat_entry(messages, status=200, path="/v1/chat/completions"):
+    return {"path": path, "request": {"model": "m", "messages": messages}, "status": status}
+
+
+def results(turns=2, **metrics):
+    values = {"turns": turns, "latency_ms": {}, "overhead_ms": {}, "export_ms": {}}
+    for name, value in metrics.items():
+        group, _, key = name.partition("__")
+        if key:
+            values[group][key] = value
+        else:
+            values[group] = value
+    return values
+
+
+def test_recorded_prompts_collapses_retries_into_one_turn():
+    first = [{"role": "system", "content": "s"}, {"role": "user", "content": "hello there"}]
+    second = first + [{"role": "assistant", "content": "hi"}, {"role": "user", "content": "what is gravity"}]
+    entries = [chat_entry(first, status=429), chat_entry(first), chat_entry(second)]
+
+    assert perf_harness.recorded_prompts(entries) == ["hello there", "what is gravity"]
+
+
+def test_recorded_prompts_keeps_repeated_prompt_with_new_history():
+    first = [{"role": "user", "content": "again"}]
+    second = first + [{"role": "assistant", "content": "ok"}, {"role": "user", "content": "again"}]
+
+    assert perf_harness.recorded_prompts([chat_entry(first), chat_entry(second)]) == ["again", "again"]
+
+
+def test_recorded_prompts_skips_other_paths_and_empty_requests():
+    entries = [
+        chat_entry([{"role": "user", "content": "x"}], path="/v1/models"),
+        {"path": "/v1/chat/completions", "request": None, "status": 200},
+    ]
+
+    assert perf_harness.recorded_prompts(entries) == []
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(10, 0, -1))
+
+    assert perf_harness.percentile(values, 50) == 5
+    assert perf_harness.percentile(values, 90) == 9
+    assert perf_harness.percentile([7.0], 90) == 7.0
+    assert perf_harness.percentile([], 50) == 0.0
+
+
+def test_distribution_summarises_values():
+    assert perf_harness.distribution([1.0, 2.0, 3.0, 6.0]) == {"count": 4, "mean": 3.0, "p50": 2.0, "p90": 6.0, "max": 6.0}
+    assert perf_harness.distribution([]) == {"count": 0, "mean": 0.0, "p50": 0.0, "p90": 0.0, "max": 0.0}
+
+
+def test_compare_flags_only_metrics_past_the_threshold():
+    baseline = results(latency_ms__p50=100.0, tokens_sent=200)
+    current = results(latency_ms__p50=125.0, tokens_sent=210)
+
+    assert perf_harness.compare(current, baseline, 0.20) == ["latency_ms.p50"]
+
+
+def test_compare_skips_p90_until_enough_turns():
+    baseline = results(turns=perf_harness.MIN_TAIL_SAMPLES - 1, latency_ms__p90=100.0)
+    current = results(turns=perf_harness.MIN_TAIL_SAMPLES - 1, latency_ms__p90=500.0)
+    assert perf_harness.compare(current, baseline, 0.20) == []
+
+    baseline["turns"] = current["turns"] = perf_harness.MIN_TAIL_SAMPLES
+    assert perf_harness.compare(current, baseline, 0.20) == ["latency_ms.p90"]
+
+
+def test_compare_skips_zero_and_missing_baselines():
+    baseline = results(overhead_ms__p50=0.0, tokens_sent=None)
+    current = results(overhead_ms__p50=12.0, tokens_sent=300)
+
+    assert perf_harness.compare(current, baseline, 0.20) == []
+
+
+def test_baseline_mismatch_detects_other_trace_and_turn_count():
+    baseline = {"trace": "a.jsonl", "trace_sha256": "abc", "turns": 3}
+
+    assert perf_harness.baseline_mismatch({"trace_sha256": "abc", "turns": 3}, baseline) is None
+    assert "different trace" in perf_harness.baseline_mismatch({"trace_sha256": "def", "turns": 3}, baseline)
+    assert "3 turns" in perf_harness.baseline_mismatch({"trace_sha256": "abc", "turns": 4}, baseline)
+
+
+def test_request_divergence_reports_params_roles_and_system_message():
+    recorded = {"model": "m", "temperature": 0.7, "messages": [{"role": "system", "content": "a"}, {"role": "user", "content": "q"}]}
+
+    assert perf_harness.request_divergence(recorded, json.loads(json.dumps(recorded))) == []
+    assert perf_harness.request_divergence(recorded, dict(recorded, temperature=0.2)) == ["temperature 0.7 -> 0.2"]
+    changed_system = dict(recorded, messages=[{"role": "system", "content": "b"}, {"role": "user", "content": "q"}])
+    assert perf_harness.request_divergence(recorded, changed_system) == ["system message (personality) changed"]
+    fewer_messages = dict(recorded, messages=[{"role": "user", "content": "q"}])
+    assert perf_harness.request_divergence(recorded, fewer_messages) == ["message roles ['system', 'user'] -> ['user']"]
+
+
+def test_scrub_removes_api_key():
+    assert perf_harness.scrub('{"key": "sk-123", "again": "sk-123"}', "sk-123") == '{"key": "***", "again": "***"}'
+    assert perf_harness.scrub("unchanged", "") == "unchanged"
+
+
+def test_chunks_round_trip_through_json_when_utf8_is_split():
+    data = "Echo ünïcode".encode("utf-8")
+    split = data.index("ü".encode("utf-8")) + 1
+    chunks = [data[:split], data[split:]]
+
+    stored = json.loads(json.dumps([perf_harness.encode_chunk(chunk) for chunk in chunks]))
+
+    assert b"".join(perf_harness.decode_chunk(text) for text in stored) == data
+
+
+def test_positive_int_rejects_values_below_one():
+    assert perf_harness.positive_int("3") == 3
+    with pytest.raises(argparse.ArgumentTypeError):
+        perf_harness.positive_int("0")